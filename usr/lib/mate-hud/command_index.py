@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+import dbus
+import dbus.bus
+import logging
+import queue
+import threading
+import time
+
+from gi.repository import GLib
+
+from dbus_guard import Deadline
+from menu_walk import walk_dbusmenu, walk_gtk_menus
+
+class CommandIndex(object):
+    """Menu items of every window with an exported menu, so the HUD can
+    search all open applications at once.
+
+    Windows are read one at a time by a background thread on its own D-Bus
+    connection, the results are handed to the main loop, which is the only
+    place the index itself is changed. A window is described by a dict with
+    'app' (WM_CLASS), 'backend' ('appmenu' or 'gtk'), 'bus' and 'path' of
+    the menu and, for gtk menus, 'action_groups' (the ( prefix, path ) pairs
+    of its action groups). Its 'items' map menu paths (as reported by the
+    walkers) to the item id (appmenu) or to [ action, target ] (gtk).
+    """
+
+    # Menus that change (LayoutUpdated, Changed) are read again this much later,
+    # so an application updating its menu several times in a row is read once
+    REFRESH_DELAY = 2 # seconds
+    # Reading a menu (AboutToShow, opened and closed events) makes many
+    # applications update it, so LayoutUpdated and Changed of a window are
+    # ignored while it's being read and this long after. Otherwise every such
+    # window would be read again and again
+    QUIET_PERIOD = 3 # seconds
+
+    def __init__(self, call_timeout=2, budget=10, policy=None):
+        self.call_timeout = call_timeout
+        self.budget = budget
+        # policy(app) gives the ExpansionPolicy to read the menus of app with
+        self.policy = policy or (lambda app: None)
+        self.windows = {}
+        # Windows that should be in the index (some may still be being read)
+        self.wanted = set()
+        # Bumped on every change, to know when the list shown in rofi needs rebuilding
+        self.generation = 0
+        self.jobs = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.dirty = set()
+        self.dirty_source = None
+        # window id: None while it's being read, then the end of its quiet period
+        self.quiet = {}
+        self.signal_matches = []
+
+    def refresh(self, window_id, window):
+        """Queue window to be (re)read in the background"""
+        self.wanted.add(window_id)
+        self.quiet[window_id] = None
+        with self.lock:
+            if window_id in self.queued:
+                return
+            self.queued.add(window_id)
+        self.jobs.put(( window_id, window, self.policy(window['app']) ))
+        if not self.thread:
+            self.thread = threading.Thread(target=self.worker, daemon=True)
+            self.thread.start()
+
+    def refresh_later(self, window_id):
+        if window_id not in self.windows:
+            return
+        self.dirty.add(window_id)
+        if not self.dirty_source:
+            self.dirty_source = GLib.timeout_add_seconds(self.REFRESH_DELAY, self.refresh_dirty)
+
+    def refresh_dirty(self):
+        self.dirty_source = None
+        dirty, self.dirty = self.dirty, set()
+        for window_id in dirty:
+            window = self.windows.get(window_id)
+            if window:
+                self.refresh(window_id, dict(( k, v ) for k, v in window.items() if k != 'items'))
+        return False
+
+    def remove(self, window_id):
+        self.wanted.discard(window_id)
+        self.quiet.pop(window_id, None)
+        if self.windows.pop(window_id, None):
+            self.generation += 1
+
+    def retain(self, window_ids):
+        """Forget the windows that aren't in window_ids (closed since)"""
+        for window_id in list(self.wanted | set(self.windows.keys())):
+            if window_id not in window_ids:
+                self.remove(window_id)
+
+    def is_quiet(self, window_id):
+        if window_id not in self.quiet:
+            return False
+        until = self.quiet[window_id]
+        return until is None or time.monotonic() < until
+
+    def find(self, bus_name, object_path):
+        # bus_name is a unique name when it comes from a signal
+        return [ window_id for window_id, window in self.windows.items()
+                 if window['path'] == object_path and bus_name in [ window['bus'], window.get('owner') ] ]
+
+    def watch(self, session_bus, windows_changed):
+        """Read menus again when their application says they changed.
+        windows_changed is called when the registrar gains or loses a window"""
+        for signal in [ 'WindowRegistered', 'WindowUnregistered' ]:
+            self.signal_matches.append(session_bus.add_signal_receiver(windows_changed, signal_name=signal,
+                                                                       dbus_interface='com.canonical.AppMenu.Registrar'))
+        def layout_updated(*args, **keywords):
+            for window_id in self.find(keywords['sender'], keywords['path']):
+                if not self.is_quiet(window_id):
+                    self.refresh_later(window_id)
+        for interface, signal in [ ( 'com.canonical.dbusmenu', 'LayoutUpdated' ),
+                                   ( 'org.gtk.Menus', 'Changed' ) ]:
+            self.signal_matches.append(session_bus.add_signal_receiver(layout_updated, signal_name=signal, dbus_interface=interface,
+                                                                       sender_keyword='sender', path_keyword='path'))
+
+    def unwatch(self):
+        for match in self.signal_matches:
+            match.remove()
+        self.signal_matches = []
+
+    def worker(self):
+        # A connection of our own, only used for blocking calls from this thread
+        bus = dbus.bus.BusConnection(dbus.bus.BUS_SESSION)
+        while True:
+            window_id, window, policy = self.jobs.get()
+            with self.lock:
+                self.queued.discard(window_id)
+            start = time.monotonic()
+            try:
+                items, owner = self.read(bus, window, policy)
+            except Exception as e:
+                logging.debug('Unable to index the menu of %s: %s', window['app'], e)
+                items, owner = None, None
+            else:
+                logging.debug('Indexed %d menu items of %s in %.1f ms', len(items), window['app'],
+                              ( time.monotonic() - start ) * 1000)
+            GLib.idle_add(self.store, window_id, window, items, owner)
+
+    def read(self, bus, window, policy):
+        deadline = Deadline(self.budget, self.call_timeout)
+        owner = window['bus'] if window['bus'].startswith(':') else str(bus.get_name_owner(window['bus']))
+        items = {}
+        if window['backend'] == 'appmenu':
+            iface = dbus.Interface(bus.get_object(window['bus'], window['path'], introspect=False), 'com.canonical.dbusmenu')
+            def add_item(path, item_id):
+                items[path] = int(item_id)
+            try:
+                walk_dbusmenu(iface, add_item, deadline.timeout, policy)
+            finally:
+                close_dbusmenu(iface, self.call_timeout)
+        else:
+            iface = dbus.Interface(bus.get_object(window['bus'], window['path'], introspect=False), 'org.gtk.Menus')
+            def add_item(path, action, target):
+                items[path] = [ str(action), target ]
+            walk_gtk_menus(iface, add_item, deadline.timeout, policy)
+        return items, owner
+
+    def store(self, window_id, window, items, owner):
+        if window_id not in self.wanted:
+            pass # closed while it was being read
+        elif items is None:
+            self.remove(window_id)
+        else:
+            self.windows[window_id] = dict(window, items=items, owner=owner)
+            self.quiet[window_id] = time.monotonic() + self.QUIET_PERIOD
+            self.generation += 1
+        return False
+
+    def stats(self):
+        return { 'windows': len(self.windows),
+                 'items': sum(len(window['items']) for window in self.windows.values()),
+                 'queued': len(self.queued) }
+
+def close_dbusmenu(dbusmenu_object_iface, timeout):
+    # Reading the menu sent "opened" events, tell the application it's closed again
+    try:
+        layout = dbusmenu_object_iface.GetLayout(0, 1, ["label"], timeout=timeout)[1]
+        timestamp = dbus.UInt32(time.time())
+        for item in layout[2]:
+            dbusmenu_object_iface.Event(item[0], "closed", dbus.String("not used", variant_level=1), timestamp,
+                                        ignore_reply=True)
+    except dbus.exceptions.DBusException:
+        pass
@@ -6,7 +6,7 @@ import os
 import re
 
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gio, Gtk
+from gi.repository import Gio, GLib, Gtk
 
 import i18n
 _ = i18n.language.gettext
@@ -70,6 +70,15 @@ class Defaults(object):
     def RECENTLY_USED_NONE():
         return 0
 
+    @constant
+    def RECENTLY_USED_LIMIT():
+        # 'Unlimited' recently used entries are still capped, so the list can't grow forever
+        return 1000
+
+    @constant
+    def CACHE_MAX_APPLICATIONS():
+        return 50
+
     @constant
     def CUSTOM_WIDTH():
         return '0'
@@ -132,7 +141,9 @@ def validate_custom_width(custom_width):
     return False
 
 def get_custom_width():
-    custom_width = get_string('org.mate.hud', None, 'custom-width')
+    return parse_custom_width(get_string('org.mate.hud', None, 'custom-width'))
+
+def parse_custom_width(custom_width):
     if validate_custom_width(custom_width):
         custom_width = re.sub(r'\s', '', custom_width)
         w = re.sub(r'(px|em|ch|%)?$', '', custom_width)
@@ -213,30 +224,82 @@ def get_transparency():
     return transparency
 
 def isrtl():
-    window = Gtk.Window()
-    style_context = window.get_style_context()
-    state = style_context.get_state()
-    return state & Gtk.StateFlags.DIR_RTL
+    # Same as the DIR_RTL state of a new window's style context, without
+    # creating (and leaking) a toplevel window every time we ask
+    return Gtk.Widget.get_default_direction() == Gtk.TextDirection.RTL
+
+class ThemeIndex(object):
+    """
+    Index of the available rofi themes (name -> path of the .rasi file).
+    Themes in the user's directory take precedence over the system ones.
+
+    The theme directories are only scanned the first time the index is used
+    and again after a file monitor (inotify) reports a change in one of them,
+    so lookups never touch the disk.
+    """
+    def __init__(self):
+        self.theme_dirs = [ os.path.expanduser('~') + '/.local/share/rofi/themes/',
+                            '/usr/share/rofi/themes/' ]
+        self.themes = None
+        self.sorted_names = None
+        self.monitors = []
+
+    def watch(self):
+        for directory in self.theme_dirs:
+            try:
+                monitor = Gio.File.new_for_path(directory).monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            except GLib.Error as e:
+                logging.info('Unable to watch %s for theme changes: %s' % ( directory, e.message ))
+                continue
+            monitor.connect('changed', self.invalidate)
+            self.monitors.append(monitor)
+
+    def invalidate(self, *args):
+        self.themes = None
+        self.sorted_names = None
+
+    def index(self):
+        if self.themes is None:
+            if not self.monitors:
+                self.watch()
+            themes = {}
+            for directory in self.theme_dirs:
+                try:
+                    entries = os.scandir(directory)
+                except OSError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        # checking if it is a file
+                        if entry.name[-5:] == '.rasi' and entry.is_file():
+                            themes.setdefault(entry.name[:-5], entry.path)
+            self.themes = themes
+        return self.themes
+
+    def names(self, sort=False):
+        if not sort:
+            return list(self.index().keys())
+        if self.sorted_names is None:
+            self.sorted_names = sorted(self.index().keys(), key=lambda theme_name: theme_name.lower())
+        return list(self.sorted_names)
+
+    def exists(self, theme):
+        return theme in self.index()
+
+    def path(self, theme):
+        return self.index().get(theme)
+
+    def hidpi_variant(self, theme):
+        if theme.endswith('-hidpi'):
+            return theme
+        if self.exists(theme + '-hidpi'):
+            return theme + '-hidpi'
+        return None
+
+THEME_INDEX = ThemeIndex()
 
 def get_theme_list(sort=False):
-    def sort_themes(theme_name):
-        return theme_name.lower()
-
-    themes = []
-    theme_dirs = [ os.path.expanduser('~') + '/.local/share/rofi/themes/' ,
-                   '/usr/share/rofi/themes/' ]
-    for directory in theme_dirs:
-        if os.path.isdir(directory):
-            for filename in os.listdir(directory):
-                f = os.path.join(directory, filename)
-                # checking if it is a file
-                if os.path.isfile(f) and filename[-5:] == '.rasi':
-                    theme = filename[:-5]
-                    if theme not in themes:
-                        themes.append( theme )
-    if sort:
-        themes.sort(key=sort_themes)
-    return themes
+    return THEME_INDEX.names(sort=sort)
 
 def rgba_to_hex(color):
    """
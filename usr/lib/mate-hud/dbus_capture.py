@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+import dbus
+import json
+import logging
+import os
+import re
+import time
+
+# Recording of the D-Bus traffic of a HUD activation, used by `mate-hud --capture`
+# to write the file and by hud-replay to serve it back.
+#
+# Values are stored with their D-Bus type so they can be sent back exactly as
+# the application sent them: { 't': type code, 'v': value, 's': signature of
+# the contents (arrays and dictionaries), 'l': variant level (if not 0) }
+# Calls also carry the 'signature' the application expects, when known.
+
+CAPTURE_VERSION = 1
+
+BASIC_TYPES = [ ( dbus.Boolean,    'b', bool  ),
+                ( dbus.Byte,       'y', int   ),
+                ( dbus.Int16,      'n', int   ),
+                ( dbus.UInt16,     'q', int   ),
+                ( dbus.Int32,      'i', int   ),
+                ( dbus.UInt32,     'u', int   ),
+                ( dbus.Int64,      'x', int   ),
+                ( dbus.UInt64,     't', int   ),
+                ( dbus.Double,     'd', float ),
+                ( dbus.ObjectPath, 'o', str   ),
+                ( dbus.Signature,  'g', str   ),
+                ( dbus.String,     's', str   ) ]
+
+# Argument signatures of the methods the HUD calls, as the applications
+# declare them. Recorded with every call so hud-replay can reject calls whose
+# arguments went out with other types, like GDBus and QtDBus do.
+SIGNATURES = { ( 'com.canonical.AppMenu.Registrar', 'GetMenuForWindow' ): 'u',
+               ( 'com.canonical.AppMenu.Registrar', 'GetMenus' ):         '',
+               ( 'com.canonical.dbusmenu',          'GetLayout' ):        'iias',
+               ( 'com.canonical.dbusmenu',          'AboutToShow' ):      'i',
+               ( 'com.canonical.dbusmenu',          'Event' ):            'isvu',
+               ( 'com.canonical.dbusmenu',          'EventGroup' ):       'a(isvu)',
+               ( 'org.gtk.Menus',                   'Start' ):            'au',
+               ( 'org.gtk.Menus',                   'End' ):              'au',
+               ( 'org.gtk.Actions',                 'Describe' ):         's',
+               ( 'org.gtk.Actions',                 'Activate' ):         'sava{sv}' }
+
+def encode(value):
+    data = None
+    for dbus_type, code, python_type in BASIC_TYPES:
+        if isinstance(value, dbus_type):
+            data = { 't': code, 'v': python_type(value) }
+            break
+    if data is None:
+        if isinstance(value, dbus.Dictionary) or isinstance(value, dict):
+            data = { 't': 'e', 'v': [ [ encode(k), encode(v) ] for k, v in value.items() ],
+                     's': getattr(value, 'signature', None) }
+        elif isinstance(value, dbus.Struct) or isinstance(value, tuple):
+            data = { 't': 'r', 'v': [ encode(v) for v in value ] }
+        elif isinstance(value, dbus.Array) or isinstance(value, list):
+            data = { 't': 'a', 'v': [ encode(v) for v in value ],
+                     's': getattr(value, 'signature', None) }
+        elif isinstance(value, bool):
+            data = { 't': 'b', 'v': value }
+        elif isinstance(value, int):
+            data = { 't': 'i', 'v': value }
+        elif isinstance(value, float):
+            data = { 't': 'd', 'v': value }
+        elif isinstance(value, str):
+            data = { 't': 's', 'v': value }
+        else:
+            raise TypeError('Unable to record value of type %s' % type(value).__name__)
+    level = getattr(value, 'variant_level', 0)
+    if level:
+        data['l'] = level
+    return data
+
+def decode(data):
+    level = data.get('l', 0)
+    code = data['t']
+    for dbus_type, c, python_type in BASIC_TYPES:
+        if c == code:
+            return dbus_type(data['v'], variant_level=level)
+    if code == 'e':
+        return dbus.Dictionary([ ( decode(k), decode(v) ) for k, v in data['v'] ],
+                               signature=data.get('s'), variant_level=level)
+    if code == 'r':
+        return dbus.Struct([ decode(v) for v in data['v'] ], variant_level=level)
+    if code == 'a':
+        return dbus.Array([ decode(v) for v in data['v'] ], signature=data.get('s'), variant_level=level)
+    raise ValueError('Unknown recorded type %s' % code)
+
+def plain(value):
+    """Value without D-Bus type information, to compare call arguments
+    regardless of how the caller's bindings typed them"""
+    if isinstance(value, dict):
+        return [ 'e' ] + sorted([ [ plain(k), plain(v) ] for k, v in value.items() ], key=json.dumps)
+    if isinstance(value, (list, tuple)):
+        return [ plain(v) for v in value ]
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+def signature_of(value):
+    if getattr(value, 'variant_level', 0):
+        return 'v'
+    for dbus_type, code, python_type in BASIC_TYPES:
+        if isinstance(value, dbus_type):
+            return code
+    if isinstance(value, dbus.Dictionary):
+        if value.signature:
+            return 'a{' + str(value.signature) + '}'
+        for k, v in value.items():
+            return 'a{' + signature_of(k) + signature_of(v) + '}'
+        return 'a{sv}'
+    if isinstance(value, dbus.Struct):
+        return '(' + ''.join(signature_of(v) for v in value) + ')'
+    if isinstance(value, dbus.Array):
+        if value.signature:
+            return 'a' + str(value.signature)
+        return 'a' + ( signature_of(value[0]) if len(value) else 'v' )
+    raise TypeError('Unable to find the signature of %s' % type(value).__name__)
+
+def outputs(result):
+    # dbus-python returns None for no output, a tuple for several outputs
+    if result is None:
+        return []
+    if isinstance(result, tuple) and not isinstance(result, dbus.Struct):
+        return list(result)
+    return [ result ]
+
+class RecordingInterface(object):
+    """Stands in for a dbus.Interface and records every method call made
+    through it (synchronous or with reply/error handlers)."""
+
+    def __init__(self, capture, iface, bus_name, object_path, dbus_interface):
+        self._capture = capture
+        self._iface = iface
+        self._target = { 'bus': str(bus_name), 'path': str(object_path), 'interface': dbus_interface }
+
+    def __getattr__(self, member):
+        method = getattr(self._iface, member)
+        def call(*args, **keywords):
+            record = dict(self._target, method=member, args=[ encode(a) for a in args ],
+                          start=self._capture.elapsed())
+            signature = keywords.get('signature', SIGNATURES.get(( self._target['interface'], member )))
+            if signature is not None:
+                record['signature'] = signature
+            start = time.monotonic()
+            def done(result=None, error=None):
+                record['duration'] = time.monotonic() - start
+                if error is not None:
+                    record['error'] = [ error.get_dbus_name() if isinstance(error, dbus.exceptions.DBusException) else None,
+                                        str(error) ]
+                else:
+                    record['out'] = [ encode(v) for v in outputs(result) ]
+                self._capture.calls.append(record)
+
+            reply_handler = keywords.get('reply_handler')
+            error_handler = keywords.get('error_handler')
+            if reply_handler or error_handler:
+                def on_reply(*values):
+                    done(result=tuple(values) if len(values) != 1 else values[0])
+                    if reply_handler:
+                        reply_handler(*values)
+                def on_error(e):
+                    done(error=e)
+                    if error_handler:
+                        error_handler(e)
+                keywords['reply_handler'] = on_reply
+                keywords['error_handler'] = on_error
+                return method(*args, **keywords)
+            try:
+                result = method(*args, **keywords)
+            except Exception as e:
+                done(error=e)
+                raise
+            if not keywords.get('ignore_reply'):
+                done(result=result)
+            return result
+        return call
+
+class Capture(object):
+    """Writes one file per HUD activation into directory with the window
+    that was active, the menu backend that answered and every D-Bus call
+    made to the application (arguments, replies and timings)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.activation = None
+        self.calls = []
+        self.started = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def start(self, window):
+        self.started = time.monotonic()
+        self.calls = []
+        self.activation = { 'version': CAPTURE_VERSION, 'window': window, 'backend': None, 'calls': self.calls }
+
+    def set_backend(self, backend):
+        if self.activation is not None:
+            self.activation['backend'] = backend
+
+    def wrap(self, iface, bus_name, object_path, dbus_interface):
+        if self.activation is None:
+            return iface
+        return RecordingInterface(self, iface, bus_name, object_path, dbus_interface)
+
+    def finish(self):
+        if self.activation is None:
+            return None
+        self.activation['duration'] = self.elapsed()
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', str(self.activation['window'].get('wm_class') or 'unknown'))
+        filename = os.path.join(self.directory, '%s-%s.json' % ( name, time.strftime('%Y%m%d-%H%M%S') ))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(self.activation, f)
+            logging.info('Captured %d D-Bus calls to %s', len(self.calls), filename)
+        except (OSError, TypeError) as e:
+            logging.error('Unable to write capture %s: %s', filename, e)
+            filename = None
+        self.activation = None
+        return filename
+
+def load(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        activation = json.load(f)
+    if activation.get('version') != CAPTURE_VERSION:
+        raise ValueError('%s: unsupported capture version %s' % ( filename, activation.get('version') ))
+    return activation
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+
+import dbus
+import logging
+import threading
+import time
+
+TIMEOUT_ERRORS = [ 'org.freedesktop.DBus.Error.NoReply',
+                   'org.freedesktop.DBus.Error.Timeout',
+                   'org.freedesktop.DBus.Error.TimedOut' ]
+
+def is_timeout(e):
+    return isinstance(e, dbus.exceptions.DBusException) and e.get_dbus_name() in TIMEOUT_ERRORS
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline(object):
+    """Timeout budget for talking to an application. Every D-Bus call gets
+    at most call_timeout seconds, and all the calls made until restart()
+    together get at most budget seconds (0 means no overall limit)."""
+
+    def __init__(self, budget, call_timeout):
+        self.budget = budget
+        self.call_timeout = call_timeout
+        self.restart()
+
+    def restart(self):
+        self.end = time.monotonic() + self.budget if self.budget > 0 else None
+
+    def pause(self):
+        """Stop counting the overall budget until restart(), every call still
+        gets at most call_timeout"""
+        self.end = None
+
+    def remaining(self):
+        if self.end is None:
+            return None
+        return self.end - time.monotonic()
+
+    def timeout(self):
+        """Timeout in seconds to use for the next D-Bus call"""
+        remaining = self.remaining()
+        if remaining is None:
+            return self.call_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded('activation budget of %.1fs used up' % self.budget)
+        return min(self.call_timeout, remaining)
+
+class Cancelled(Exception):
+    pass
+
+class CancellationToken(object):
+    """Tells work in progress to stop. cancel() may be called from any
+    thread, the work itself calls check() before every step and stops with
+    Cancelled once it was cancelled. Only the first reason is kept."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.reason = None
+
+    def cancel(self, reason):
+        with self.lock:
+            if not self.event.is_set():
+                self.reason = reason
+                self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled(self.reason)
+
+class CircuitBreaker(object):
+    """Skips applications that repeatedly failed to answer in time.
+
+    After threshold consecutive failures the breaker for that key trips and
+    allow() returns False for cooldown seconds. The first attempt after the
+    cool-down is a trial: a success resets the breaker, a failure trips it
+    again right away. A threshold of 0 disables the breaker."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.open_until = {}
+        self.trips = 0
+        self.skipped = 0
+
+    def allow(self, key):
+        until = self.open_until.get(key)
+        if until is None:
+            return True
+        if time.monotonic() < until:
+            self.skipped += 1
+            return False
+        # Cool-down over, let one attempt through
+        del self.open_until[key]
+        self.failures[key] = max(self.threshold - 1, 0)
+        return True
+
+    def success(self, key):
+        self.failures.pop(key, None)
+
+    def failure(self, key):
+        if self.threshold <= 0:
+            return
+        self.failures[key] = self.failures.get(key, 0) + 1
+        if self.failures[key] >= self.threshold:
+            self.open_until[key] = time.monotonic() + self.cooldown
+            self.trips += 1
+            logging.warning('%s failed to answer %d times in a row, skipping it for %d seconds (%d trips so far)',
+                            key, self.failures[key], self.cooldown, self.trips)
+            del self.failures[key]
+
+    def stats(self):
+        now = time.monotonic()
+        return { 'trips': self.trips,
+                 'skipped': self.skipped,
+                 'open': sorted(k for k, v in self.open_until.items() if v > now),
+                 'failing': dict(self.failures) }
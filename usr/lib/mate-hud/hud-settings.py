@@ -1,69 +1,75 @@
 #!/usr/bin/python3
 
+import argparse
 import gi
 import logging
 import os.path
 import re
 import setproctitle
+import time
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
-from gi.repository import Gdk, Gio, Gtk
+from gi.repository import Gdk, Gio, GLib, Gtk
 
 from common import *
-import getkey_dialog
 
 import i18n
 _ = i18n.language.gettext
 
 class HUDCurrentSettings():
+    # Reads from a snapshot of the gsettings keys (see HUDSettingsWindow.load_view_model())
+    # instead of asking gsettings every time
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
     @property
     def shortcut(self):
-        return get_string( 'org.mate.hud', None, 'shortcut' )
+        return self.snapshot['shortcut']
 
     @property
     def use_custom_width(self):
-        return get_custom_width()[0]
+        return self.snapshot['custom-width'][0]
 
     @property
     def custom_width(self):
-        return int(get_custom_width()[1])
+        return int(self.snapshot['custom-width'][1])
 
     @property
     def custom_width_units(self):
-        return get_custom_width()[2]
+        return self.snapshot['custom-width'][2]
 
     @property
     def location(self):
-        return get_string( 'org.mate.hud', None, 'location' )
+        return self.snapshot['location']
 
     @property
     def rofi_theme(self):
-        return get_string( 'org.mate.hud', None, 'rofi-theme' )
+        return self.snapshot['rofi-theme']
 
     @property
     def monitor(self):
-        return get_string( 'org.mate.hud', None, 'hud-monitor' )
+        return self.snapshot['hud-monitor']
 
     @property
     def recently_used_max(self):
-        return get_number( 'org.mate.hud', None, 'recently-used-max' )
+        return self.snapshot['recently-used-max']
 
     @property
     def menu_separator(self):
-        return get_string( 'org.mate.hud', None, 'menu-separator' )
+        return self.snapshot['menu-separator']
 
     @property
     def use_prompt(self):
-        return get_string( 'org.mate.hud', None, 'prompt' ) != ''
+        return self.snapshot['prompt'] != ''
 
     @property
     def prompt(self):
-        return get_string( 'org.mate.hud', None, 'prompt' )
+        return self.snapshot['prompt']
 
     @property
     def transparency(self):
-        return get_number( 'org.mate.hud', None, 'transparency' )
+        return self.snapshot['transparency']
     # Add new properties here that return the current value of a gsettings key
 
 class HUDSettingsWindow(Gtk.Window):
@@ -119,7 +125,8 @@ class HUDSettingsWindow(Gtk.Window):
              'menu-separator',
              'custom-width',
              'recently-used-max',
-             'prompt' ]
+             'prompt',
+             'transparency' ]
 
     valid_units = [ 'px', 'em', 'ch', '%' ]
     single_modifier_keys = [ 'Alt_L', 'Alt_R', 'Ctrl_L', 'Ctrl_R', 'Super_L', 'Super_R' ]
@@ -131,6 +138,18 @@ class HUDSettingsWindow(Gtk.Window):
         self.set_resizable(False)
         self.set_icon_name("mate-hud")
 
+        # All our reads go through this object, writes either directly or in a batch()
+        self.settings = Gio.Settings.new('org.mate.hud')
+        # key: value we wrote and haven't seen the change notification for yet
+        self.own_writes = {}
+        # Values of the keys as last shown in the widgets, see reload_view()
+        self.view_model = {}
+        self.pending_keys = set()
+        self.pending_source = None
+        # Sorted theme names, None until the window has been drawn (see load_themes())
+        self.themes = None
+        self.draw_handler = None
+
         box_outer = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=50)
         self.add(box_outer)
 
@@ -271,11 +290,18 @@ class HUDSettingsWindow(Gtk.Window):
 
     def show_all(self):
         super().show_all()
+        self.validate_settings()
         self.reload_view()
         # Connect to the widget changed signals after we load the view
         # and establish the widget's initial values. Otherwise, the we'll
         # be responding to change signals as we load the initial state
         self.connect_to_signals()
+        self.draw_handler = self.connect_after('draw', self.drawn)
+
+    def drawn(self, widget, cr):
+        self.disconnect(self.draw_handler)
+        self.draw_handler = None
+        GLib.idle_add(self.load_themes)
 
     def add_custom_css_classes(self):
         screen = Gdk.Screen.get_default()
@@ -342,8 +368,10 @@ class HUDSettingsWindow(Gtk.Window):
             w.set_has_tooltip(False)
 
     def on_shortcut_clicked(self, widget):
+        # Only loaded when needed, most of the time the dialog is never shown
+        import getkey_dialog
         keystr = getkey_dialog.ask_for_key(
-            previous_key=get_string('org.mate.hud', None, 'shortcut'),
+            previous_key=self.view_model['shortcut'],
             screen=widget.get_screen(),
             parent=widget.get_toplevel()
         )
@@ -353,39 +381,69 @@ class HUDSettingsWindow(Gtk.Window):
         w.set_label(keystr)
         self.selection_changed(w)
 
+    def batch(self):
+        # Settings object whose writes reach dconf in one go when apply() is
+        # called. A new one every time, self.settings itself keeps writing through
+        settings = Gio.Settings.new('org.mate.hud')
+        settings.delay()
+        return settings
+
+    def write(self, key, value, settings=None):
+        # value is a GLib.Variant. Keys that already have the value aren't
+        # written at all, so they don't cause a change notification either
+        settings = settings or self.settings
+        if settings.get_value(key).equal(value):
+            return
+        self.own_writes[key] = value
+        settings.set_value(key, value)
+
+    def reset(self, key, settings=None):
+        # Back to the schema default, rather than writing the default as a user value
+        settings = settings or self.settings
+        if settings.get_user_value(key) is None:
+            return
+        self.own_writes[key] = settings.get_default_value(key)
+        settings.reset(key)
+
     def reset_to_defaults(self, button):
         logging.info(_("Resetting all settings to default"))
-        settings = Gio.Settings.new('org.mate.hud')
+        batch = self.batch()
         for key in self.keys:
-            settings.reset(key)
+            self.reset(key, batch)
+        batch.apply()
+        self.reload_view()
 
     def reset_recently_used(self, button):
         logging.info(_("Resetting recently used menu entry list"))
-        Gio.Settings.new('org.mate.hud').reset('recently-used')
+        self.settings.reset('recently-used')
 
     def apply_changes(self, button):
         logging.info(_("Applying changes"))
 
-        settings = Gio.Settings.new('org.mate.hud')
-        settings.set_string( 'shortcut',          self.get_widget_by_name('custom-shortcut').get_label())
-        settings.set_string( 'hud-monitor',       self.get_widget_by_name('monitor').get_active_text())
-        settings.set_string( 'location',          self.get_widget_by_name('location').get_active_text())
-        settings.set_string( 'rofi-theme',        self.get_widget_by_name('theme').get_active_text())
-        settings.set_string( 'menu-separator',    self.get_widget_by_name('separator').get_active_text())
-        settings.set_int(    'recently-used-max', self.get_widget_by_name('recently-used').get_value_as_int())
-        settings.set_int(    'transparency',      self.get_widget_by_name('transparency').get_value_as_int())
         if self.get_widget_by_name('use-prompt').get_active():
-            settings.set_string( 'prompt',        self.get_widget_by_name('prompt').get_text())
+            prompt = self.get_widget_by_name('prompt').get_text()
         else:
-            settings.set_string( 'prompt',        '')
-
+            prompt = ''
         if self.get_widget_by_name('use-width').get_active():
-            settings.set_string('custom-width', \
-                                str(self.get_widget_by_name('width').get_value_as_int()) + \
-                                self.get_widget_by_name('width-units').get_active_text())
+            custom_width = str(self.get_widget_by_name('width').get_value_as_int()) + \
+                           self.get_widget_by_name('width-units').get_active_text()
         else: # Default is use the theme width (no custom width, so apply that if the checkbutton isn't checked
-            settings.set_string('custom-width', HUD_DEFAULTS.CUSTOM_WIDTH)
-
+            custom_width = HUD_DEFAULTS.CUSTOM_WIDTH
+
+        batch = self.batch()
+        self.write( 'shortcut',          GLib.Variant('s', self.get_widget_by_name('custom-shortcut').get_label()), batch)
+        self.write( 'hud-monitor',       GLib.Variant('s', self.get_widget_by_name('monitor').get_active_text()), batch)
+        self.write( 'location',          GLib.Variant('s', self.get_widget_by_name('location').get_active_text()), batch)
+        self.write( 'rofi-theme',        GLib.Variant('s', self.get_widget_by_name('theme').get_active_text()), batch)
+        self.write( 'menu-separator',    GLib.Variant('s', self.get_widget_by_name('separator').get_active_text()), batch)
+        self.write( 'recently-used-max', GLib.Variant('i', self.get_widget_by_name('recently-used').get_value_as_int()), batch)
+        self.write( 'transparency',      GLib.Variant('i', self.get_widget_by_name('transparency').get_value_as_int()), batch)
+        self.write( 'prompt',            GLib.Variant('s', prompt), batch)
+        self.write( 'custom-width',      GLib.Variant('s', custom_width), batch)
+        batch.apply()
+
+        # The widgets already show the new values, this only brings the view model up to date
+        self.reload_view(keys=self.keys)
         self.selection_changed_all()
 
     def selection_changed_all( self ):
@@ -408,7 +466,7 @@ class HUDSettingsWindow(Gtk.Window):
         if widget.get_name() == 'shortcut' and widget.get_active_text() == _('Custom') + ': ':
             widget = self.get_widget_by_name( 'custom-shortcut' )
         widget_type =  type(widget).__name__
-        current_value = getattr( HUDCurrentSettings(), self.widget_property_map.get( widget.get_name() ) )
+        current_value = getattr( HUDCurrentSettings( self.view_model ), self.widget_property_map.get( widget.get_name() ) )
         displayed_value = current_value # assume not changed, til we get the value
         if   widget_type == 'Button':       displayed_value = widget.get_label()
         elif widget_type == 'SpinButton':   displayed_value = widget.get_value_as_int()
@@ -435,17 +493,110 @@ class HUDSettingsWindow(Gtk.Window):
             self.get_widget_by_name(name).connect( signal, getattr( self, function ) )
 
     def reload_view_on_change(self, schema, key):
+        own_write = self.own_writes.pop(key, None)
+        if own_write is not None and schema.get_value(key).equal(own_write):
+            return # we wrote this value, the view already shows it
+        # Keys changed together (e.g. by dconf load) are reloaded together
+        self.pending_keys.add(key)
+        if not self.pending_source:
+            self.pending_source = GLib.idle_add(self.reload_pending_keys)
+
+    def reload_pending_keys(self):
+        keys, self.pending_keys = self.pending_keys, set()
+        self.pending_source = None
         logging.info( _("Reloading view in response to key change.") )
-        self.reload_view(key=key)
+        self.reload_view(keys=keys)
+        return False
 
     def reset_view(self, button):
         self.reload_view()
 
-    def reload_view(self, key=None):
-        logging.info(_("Reloading view") + ( " " + _('for') + " " + key if key else "" ) )
-
-        if not key or key == 'shortcut':
-            shortcut = get_string( 'org.mate.hud', None, 'shortcut' )
+    def load_themes(self):
+        # Scanning the theme directories and filling the list is left until
+        # the window is on screen, until then the list only has the current theme
+        if self.themes is None:
+            self.themes = get_theme_list(sort=True)
+            self.validate_settings()
+            self.reload_view(keys=['themes'])
+        return False
+
+    def validate_settings(self):
+        # Values the daemon can't use are replaced by the defaults, like
+        # common.py does. Only done on start-up and once the themes are
+        # known, reading the settings never writes them
+        if self.themes is not None and self.settings.get_string('rofi-theme') not in self.themes:
+            self.write('rofi-theme', GLib.Variant('s', HUD_DEFAULTS.THEME))
+        try:
+            parse_custom_width(self.settings.get_string('custom-width'))
+        except ValueError:
+            self.write('custom-width', GLib.Variant('s', HUD_DEFAULTS.CUSTOM_WIDTH))
+
+    def load_view_model(self, keys=None):
+        """Snapshot of keys (by default all the keys shown in the window),
+        read through self.settings. Invalid values read as their default,
+        see validate_settings()."""
+        settings = self.settings
+        keys = set(self.keys + [ 'themes' ] if keys is None else keys)
+        # The theme is checked against the list, so they're always read together
+        if 'themes' in keys or 'rofi-theme' in keys:
+            keys |= { 'themes', 'rofi-theme' }
+        model = {}
+        if 'shortcut' in keys:
+            model['shortcut'] = settings.get_string('shortcut')
+
+        if 'themes' in keys:
+            if self.themes is not None:
+                # Only rescanned if the theme directories changed since
+                self.themes = get_theme_list(sort=True)
+            model['themes'] = self.themes
+            model['rofi-theme'] = settings.get_string('rofi-theme')
+            if self.themes is not None and model['rofi-theme'] not in self.themes:
+                model['rofi-theme'] = HUD_DEFAULTS.THEME
+
+        if 'custom-width' in keys:
+            try:
+                model['custom-width'] = parse_custom_width(settings.get_string('custom-width'))
+            except ValueError:
+                model['custom-width'] = parse_custom_width(HUD_DEFAULTS.CUSTOM_WIDTH)
+
+        if 'prompt' in keys:
+            model['prompt'] = settings.get_string('prompt')
+        if 'hud-monitor' in keys:
+            model['hud-monitor'] = settings.get_string('hud-monitor')
+            if model['hud-monitor'] not in HUD_DEFAULTS.VALID_MONITORS:
+                model['hud-monitor'] = HUD_DEFAULTS.MONITOR
+        if 'location' in keys:
+            model['location'] = settings.get_string('location')
+            if model['location'] not in HUD_DEFAULTS.VALID_LOCATIONS:
+                logging.error(_("Invalid location specified, defaulting to ") + 'default')
+                model['location'] = 'default'
+        if 'menu-separator' in keys:
+            model['menu-separator'] = settings.get_string('menu-separator')
+        if 'recently-used-max' in keys:
+            model['recently-used-max'] = settings.get_int('recently-used-max')
+        if 'transparency' in keys:
+            model['transparency'] = settings.get_int('transparency')
+        return model
+
+    def reload_view(self, keys=None):
+        """Show the current settings. With keys, only those keys are read
+        and only the widgets of the ones whose value differs from what was
+        shown last time are updated. Otherwise all of them are (discarding
+        any changes not applied yet)."""
+        model = self.load_view_model(keys)
+        if keys is None:
+            logging.info(_("Reloading view"))
+            changed = set(model.keys())
+        else:
+            changed = set(k for k in model.keys() if model[k] != self.view_model.get(k))
+            if not changed:
+                return
+            logging.info(_("Reloading view") + " " + _('for') + " " + ', '.join(sorted(changed)))
+            model = dict(self.view_model, **model)
+        self.view_model = model
+
+        if 'shortcut' in changed:
+            shortcut = model['shortcut']
             if shortcut in self.single_modifier_keys:
                 self.get_widget_by_name('shortcut').set_active(self.single_modifier_keys.index(shortcut))
                 self.get_widget_by_name('custom-shortcut').set_visible(False)
@@ -453,27 +604,20 @@ class HUDSettingsWindow(Gtk.Window):
                 # The shortcut combobox has all the single modifiers, then 'Custom: '
                 self.get_widget_by_name('shortcut').set_active(len(self.single_modifier_keys))
                 self.get_widget_by_name('custom-shortcut').set_visible(True)
-            self.get_widget_by_name('custom-shortcut').set_label( get_string( 'org.mate.hud', None, 'shortcut' ) )
+            self.get_widget_by_name('custom-shortcut').set_label( shortcut )
 
-        if not key or key == 'rofi-theme':
-            themes = get_theme_list(sort=True)
+        if 'themes' in changed or 'rofi-theme' in changed:
+            # Until the themes are loaded the list only holds the current theme
+            themes = model['themes'] or [ model['rofi-theme'] ]
             widget = self.get_widget_by_name('theme')
-            widget.remove_all()
-            for u in range(len(themes)):
-                widget.insert(u, str(u), themes[u])
-            try:
-                widget.set_active(themes.index(get_rofi_theme()))
-            except:
-                Gio.Settings.new('org.mate.hud').set_string('rofi-theme', HUD_DEFAULTS.THEME)
-                widget.set_active(themes.index(HUD_DEFAULTS.THEME))
-
-        if not key or key == 'custom-width':
-            try:
-                use_width, width, units = get_custom_width()
-            except:
-                Gio.Settings.new('org.mate.hud').set_string('custom-width', HUD_DEFAULTS.CUSTOM_WIDTH)
-                use_width, width, units = get_custom_width()
-
+            if 'themes' in changed or model['themes'] is None:
+                widget.remove_all()
+                for u in range(len(themes)):
+                    widget.insert(u, str(u), themes[u])
+            widget.set_active(themes.index(model['rofi-theme']))
+
+        if 'custom-width' in changed:
+            use_width, width, units = model['custom-width']
             widget_use = self.get_widget_by_name('use-width')
             widget_width = self.get_widget_by_name('width')
             widget_units = self.get_widget_by_name('width-units')
@@ -486,29 +630,35 @@ class HUDSettingsWindow(Gtk.Window):
                 widget_units.set_active(self.valid_units.index(units))
                 widget_width.set_adjustment( self.width_adjustments[self.get_widget_by_name('width-units').get_active_text()] )
 
-        if not key or key == 'prompt':
-            use_prompt = HUDCurrentSettings().use_prompt
+        if 'prompt' in changed:
+            use_prompt = model['prompt'] != ''
             self.get_widget_by_name('use-prompt').set_active(use_prompt)
-            self.get_widget_by_name('prompt').set_text( HUDCurrentSettings().prompt )
+            self.get_widget_by_name('prompt').set_text( model['prompt'] )
             self.get_widget_by_name('prompt').set_visible( use_prompt )
 
-        if not key or key == 'hud-monitor':
-            self.get_widget_by_name('monitor').set_active(HUD_DEFAULTS.VALID_MONITORS.index(get_monitor()))
+        if 'hud-monitor' in changed:
+            self.get_widget_by_name('monitor').set_active(HUD_DEFAULTS.VALID_MONITORS.index(model['hud-monitor']))
 
-        if not key or key == 'location':
-            self.get_widget_by_name('location').set_active(HUD_DEFAULTS.VALID_LOCATIONS.index(get_location()))
+        if 'location' in changed:
+            self.get_widget_by_name('location').set_active(HUD_DEFAULTS.VALID_LOCATIONS.index(model['location']))
 
-        if not key or key == 'menu-separator':
-            self.get_widget_by_name('separator').set_active(HUD_DEFAULTS.VALID_SEPARATOR_PAIRS.index(get_menu_separator_pair()))
+        if 'menu-separator' in changed:
+            self.get_widget_by_name('separator').set_active(HUD_DEFAULTS.VALID_SEPARATOR_PAIRS.index(model['menu-separator']))
 
-        if not key or key == 'recently-used-max':
-            self.get_widget_by_name('recently-used').set_value(get_recently_used_max())
+        if 'recently-used-max' in changed:
+            self.get_widget_by_name('recently-used').set_value(model['recently-used-max'])
             self.recent_max_update_tooltip()
 
-        if not key or key == 'transparency':
-            self.get_widget_by_name('transparency').set_value(get_transparency())
+        if 'transparency' in changed:
+            self.get_widget_by_name('transparency').set_value(model['transparency'])
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='MATE HUD settings')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='print the time in ms it took until the window was first drawn and quit (see hud-settings-bench)')
+    args = parser.parse_args()
+    started = time.monotonic()
+
     setproctitle.setproctitle('hud-settings')
     logging.basicConfig(level=logging.INFO)
 
@@ -518,5 +668,12 @@ if __name__ == "__main__":
     for k in win.keys:
         settings.connect("changed::" + k, win.reload_view_on_change)
 
+    if args.startup_time:
+        def drawn(widget, cr):
+            win.disconnect(handler)
+            print('%.1f' % ( ( time.monotonic() - started ) * 1000 ), flush=True)
+            GLib.idle_add(Gtk.main_quit)
+        handler = win.connect_after("draw", drawn)
+
     win.show_all()
     Gtk.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+
+from gi.repository import GLib
+
+def approximate_size(obj, seen=None):
+    """Rough number of bytes used by obj and everything it contains"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(k, seen) + approximate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(v, seen) for v in obj)
+    return size
+
+class LRUCache(collections.OrderedDict):
+    """Dictionary holding at most maxsize entries. Reading or writing an
+    entry makes it the most recently used one, the least recently used
+    entry is dropped when the cache is full."""
+
+    def __init__(self, maxsize, *args, **kwargs):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        self.shrink()
+
+    def get(self, key, default=None):
+        if key in self:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self.shrink()
+
+    def shrink(self):
+        while self.maxsize > 0 and len(self) > self.maxsize:
+            self.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return { 'entries': len(self), 'max': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                 'evictions': self.evictions, 'bytes': approximate_size(dict(self)) }
+
+class MenuSnapshots(object):
+    """Per application (WM_CLASS) snapshots of the flattened menu, persisted to
+    $XDG_CACHE_HOME/mate-hud so the HUD can show something useful on the first
+    activation after login, before the live menu has been walked.
+
+    Snapshot items are keyed by the labels of their menu path (a tuple), so
+    changing the separator doesn't invalidate them. Each item stores the
+    backend that produced it and what that backend needs to activate it.
+    """
+
+    VERSION = 3
+
+    def __init__(self, cache_dir=None, max_apps=50):
+        self.cache_dir = cache_dir or os.path.join(GLib.get_user_cache_dir(), 'mate-hud')
+        # Only the snapshots of the most recently used applications are kept in
+        # memory, the others are read from disk again when needed
+        self.snapshots = LRUCache(max_apps)
+        self.lock = threading.Lock()
+
+    def filename(self, app):
+        return os.path.join(self.cache_dir, 'menu-' + app.replace('/', '_') + '.json')
+
+    def get(self, app):
+        # Snapshots are only read from disk the first time they're needed
+        items = self.snapshots.get(app)
+        if items is None:
+            items = self.load(app)
+            self.snapshots[app] = items
+        return items
+
+    def lookup(self, app, path):
+        return self.get(app).get(path)
+
+    def load(self, app):
+        items = {}
+        try:
+            with open(self.filename(app), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                for path, backend, action, target in data.get('items', []):
+                    items[tuple(path)] = [ backend, action, target ]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.info('Ignoring unreadable menu snapshot for %s: %s', app, e)
+        return items
+
+    def update(self, app, backend, actions, targets=None):
+        """Replace the snapshot of app with the live menu read by backend.
+        actions maps menu paths (tuples of labels) to the backend's action,
+        targets (optional) maps them to the action target."""
+        targets = targets or {}
+        items = {}
+        for path, action in actions.items():
+            items[path] = [ backend, action, targets.get(path) ]
+        if items == self.get(app):
+            return
+        self.snapshots[app] = items
+        try:
+            data = json.dumps({ 'version': self.VERSION,
+                                'items': [ [ list(path) ] + item for path, item in items.items() ] },
+                              separators=(',', ':'))
+        except (TypeError, ValueError) as e:
+            logging.info('Unable to serialize menu snapshot for %s: %s', app, e)
+            return
+        threading.Thread(target=self.save, args=(app, data), daemon=True).start()
+
+    def save(self, app, data):
+        filename = self.filename(app)
+        with self.lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(filename + '.tmp', filename)
+            except OSError as e:
+                logging.info('Unable to save menu snapshot for %s: %s', app, e)
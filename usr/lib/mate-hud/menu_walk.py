@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+import dbus
+import heapq
+import itertools
+import time
+
+from dbus_guard import is_timeout
+
+# The menu walkers only talk D-Bus and report what they find through
+# add_item(), so they can be run (and timed) against a replayed menu
+# without a display, rofi or the rest of the daemon.
+#
+# path arguments are the labels of the menu hierarchy joined with " > "
+# (starting with " > "), timeout() gives the timeout for the next D-Bus call.
+# timeout() may also raise to stop the walk (budget used up, walk cancelled),
+# the exception is passed on to the caller.
+#
+# The interfaces passed in needn't be introspected, so every argument that
+# dbus-python would guess wrong (variants, unsigned ints) is typed here.
+#
+# Submenus are expanded breadth first, so the top level items reach rofi
+# before the application has to build its deep (and often expensive, like
+# bookmarks or recent documents) submenus. An ExpansionPolicy decides in
+# which order and how far.
+
+def path_labels(path):
+    """Labels of a menu path without mnemonics, so paths written with
+    different separators (walker paths, recently used items) compare equal"""
+    return tuple(label.strip().replace('_', '') for label in path.split('>') if label.strip())
+
+class ExpansionPolicy(object):
+    """Order and extent of a menu walk.
+
+    max_depth: number of submenu levels to expand (0: all of them)
+    max_items: stop after reporting this many items (0: no limit)
+    excluded:  paths of submenus that are never expanded
+    preferred: paths of items to read first within their level (the
+               recently used ones), submenus leading to them come first too
+    """
+
+    def __init__(self, max_depth=0, max_items=0, excluded=(), preferred=()):
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.excluded = set(path_labels(path) for path in excluded)
+        self.preferred = set()
+        for path in preferred:
+            labels = path_labels(path)
+            for i in range(1, len(labels) + 1):
+                self.preferred.add(labels[:i])
+        self.items = 0
+        self.seq = itertools.count()
+
+    def expand(self, path, depth):
+        """Whether the submenu at path, depth levels down, should be read"""
+        if self.max_depth > 0 and depth > self.max_depth:
+            return False
+        return path_labels(path) not in self.excluded
+
+    def priority(self, path, depth):
+        # The sequence number keeps menu order within a level and makes sure
+        # the queued D-Bus structures themselves are never compared
+        return ( depth, path_labels(path) not in self.preferred, next(self.seq) )
+
+    def add(self):
+        self.items += 1
+
+    def full(self):
+        return self.max_items > 0 and self.items >= self.max_items
+
+"""
+  walk_dbusmenu
+"""
+def walk_dbusmenu(dbusmenu_object_iface, add_item, timeout, policy=None):
+    """Expand the submenus of a com.canonical.dbusmenu menu allowed by policy
+    and call add_item(path, item_id) for every item that has no children."""
+    policy = policy or ExpansionPolicy()
+    dbusmenu_root_item = dbusmenu_object_iface.GetLayout(0, 0, ["label", "children-display"], timeout=timeout())
+
+    #For excluding items which have no action
+    blacklist = set()
+
+    # [ priority, item, path of the parent, depth ]
+    pending = []
+    def queue(item, path, depth):
+        label = item[1].get('label')
+        heapq.heappush(pending, [ policy.priority(path + " > " + label if label else path, depth), item, path, depth ])
+
+    """ expanse_menu_with_dbus """
+    def expanse_menu_with_dbus(item, path, depth):
+        item_id = item[0]
+        item_props = item[1]
+
+        if 'label' in item_props:
+            new_path = path + " > " + item_props['label']
+        else:
+            new_path = path
+
+        # expand if necessary
+        if 'children-display' in item_props:
+            if depth > 0 and not policy.expand(new_path, depth):
+                return
+            dbusmenu_object_iface.AboutToShow(item_id, timeout=timeout())
+            dbusmenu_object_iface.Event(item_id, "opened", dbus.String("not used", variant_level=1), dbus.UInt32(time.time()),
+                                        timeout=timeout()) #fix firefox
+        try:
+            item = dbusmenu_object_iface.GetLayout(item_id, 1, ["label", "children-display"], timeout=timeout())[1]
+        except dbus.exceptions.DBusException as e:
+            if is_timeout(e):
+                raise
+            return
+
+        item_children = item[2]
+
+        if len(item_children) == 0:
+            if new_path not in blacklist:
+                add_item(new_path, item_id)
+                policy.add()
+        else:
+            blacklist.add(new_path)
+            for child in item_children:
+                queue(child, new_path, depth + 1)
+
+    expanse_menu_with_dbus(dbusmenu_root_item[1], "", 0)
+    while pending and not policy.full():
+        priority, item, path, depth = heapq.heappop(pending)
+        expanse_menu_with_dbus(item, path, depth)
+
+"""
+  walk_gtk_menus
+"""
+def walk_gtk_menus(gtk_menu_menus_iface, add_item, timeout, policy=None):
+    """Read the layers of an org.gtk.Menus menu allowed by policy and call
+    add_item(path, action, target) for every entry with an action
+    ('group.name', target is None if the entry has none)."""
+    policy = policy or ExpansionPolicy()
+
+    # Here's the deal: The idea is to reduce the number of calls to the proxy and keep it as low as possible
+    # because the proxy is a potential bottleneck
+    # This means we ignore GMenus standard building model and just iterate over all the information one Start() provides at once
+    # Start() does these calls, returns the result and keeps track of all parents (the IDs used by org.gtk.Menus.Start()) we called
+    # queue() adds a parent to a potential_new_layers heap; we'll use this later to avoid starting() some layers twice
+    # The heap is ordered by the policy: shallow layers first, then the ones leading to recently used entries
+    # explore is for iterating over the information a Start() call provides
+
+    usedLayers = []
+    def Start(i):
+        usedLayers.append(i)
+        return gtk_menu_menus_iface.Start(dbus.Array([i], signature='u'), timeout=timeout())
+
+    # --- Construct menu list ---
+
+    potential_new_layers = []
+    def queue(potLayer, label, path):
+        # collects potentially new layers to check them against usedLayers
+        # potLayer: ID of potential layer, label: None if nondescript, path
+        # Sections don't add a level, so the depth is the number of submenus in the path
+        depth = len(path_labels(path))
+        if depth > 0 and not policy.expand(path, depth):
+            return
+        heapq.heappush(potential_new_layers, [policy.priority(path, depth), potLayer, label, path])
+
+    def explore(parent, path):
+        for node in parent:
+            content = node[2]
+            # node[0] = ID of parent
+            # node[1] = ID of node under parent
+            # node[2] = actuall content of a node; this is split up into several elements/ menu entries
+            for element in content:
+                # We distinguish between labeled entries and unlabeled ones
+                # Unlabeled sections/ submenus get added under to parent ({parent: {content}}), labeled under a key in parent (parent: {label: {content}})
+                if 'label' in element:
+                    if ':section' in element or ':submenu' in element:
+                        # If there's a section we don't care about the action
+                        # There theoretically could be a section that is also a submenu, so we have to handel this via queue
+                        # submenus are more important than sections
+                        if ':submenu' in element:
+                            queue(element[':submenu'][0], None, path + " > " + element['label'])
+                            # We ignore whether or not a submenu points to a specific index, shouldn't matter because of the way the menu got exportet
+                            # Worst that can happen are some duplicates
+                            # Also we don't Start() directly which could mean we get nothing under this label but this shouldn't really happen because there shouldn't be two submenus
+                            # that point to the same parent. Even if this happens it's not that big of a deal.
+                        if ':section' in element:
+                            if element[':section'][0] != node[0]:
+                                queue(element['section'][0], element['label'], path)
+                                # section points to other parent, we only want to add the elements if their parent isn't referenced anywhere else
+                                # We do this because:
+                                # a) It shouldn't happen anyways
+                                # b) The worst that could happen is we fuck up the menu structure a bit and avoid double entries
+                    elif 'action' in element:
+                        # This is pretty straightforward:
+                        if policy.full():
+                            return
+                        # Keep the group prefix (app., win., unity.), it says which action group to activate it on
+                        add_item(path + " > " + element['label'], str(element['action']), element.get('target'))
+                        policy.add()
+                else:
+                    if ':submenu' in element or ':section' in element:
+                        if ':section' in element:
+                            if element[':section'][0] != node[0] and element['section'][0] not in usedLayers:
+                                queue(element[':section'][0], None, path)
+                                # We will only queue a nondescript section if it points to a (potentially) new parent
+                        if ':submenu' in element:
+                            queue(element[':submenu'][0], None, path)
+                            # We queue the submenu under the parent without a label
+
+    queue(0, None, "")
+    # We queue the first parent, [0]
+    # This means 0 gets added to potential_new_layers with a path of "" (it's the root node)
+
+    try:
+        while len(potential_new_layers) > 0 and not policy.full():
+            priority, potLayer, label, path = heapq.heappop(potential_new_layers)
+            # usedLayers keeps track of all the parents Start() already called
+            if potLayer not in usedLayers:
+                explore(Start(potLayer), path)
+    finally:
+        # Also when the walk was cut short (timeout() raising): the application
+        # keeps the subscriptions until told we're no longer interested
+        gtk_menu_menus_iface.End(dbus.Array(usedLayers, signature='u'), ignore_reply=True)